@@ -28,6 +28,8 @@
 
 #define CHAOS_SIZE	64
 #define CHAOS_BUF_SAMPLES	512
+#define CHAOS_TRANSFER_SIZE	(256 * 1024)
+#define CHAOS_TRANSFERS	8
 #define USB_TIMEOUT_MS	10000
 
 #define CHAOS_VENDOR	0x1d50
@@ -207,6 +209,128 @@ chaoskey_read(struct chaoskey *ck, int endpoint, void *buffer, int len)
 	return total;
 }
 
+/*
+ * Streaming reads keep several large bulk transfers queued on the
+ * endpoint, so the device keeps sending while completed buffers are
+ * written out. Transfers on one endpoint complete in submission order,
+ * which keeps the output in order.
+ */
+struct chaoskey_stream {
+	unsigned long	length;		/* bytes not yet submitted */
+	int		infinite;
+	int		active;		/* transfers in flight */
+	int		failed;
+};
+
+static uint8_t chaoskey_stream_buf[CHAOS_TRANSFERS][CHAOS_TRANSFER_SIZE];
+
+/* Static, so a transfer that outlives chaoskey_stream never points at a dead frame */
+static struct chaoskey_stream chaoskey_stream_state;
+
+static void
+chaoskey_stream_submit(struct chaoskey_stream *stream, struct libusb_transfer *transfer)
+{
+	int	len = CHAOS_TRANSFER_SIZE;
+	int	ret;
+
+	if (!stream->infinite) {
+		if (!stream->length)
+			return;
+		if (stream->length < (unsigned long) len)
+			len = (int) stream->length;
+	}
+	transfer->length = len;
+	ret = libusb_submit_transfer(transfer);
+	if (ret) {
+		fprintf(stderr, "read: %s\n", libusb_strerror(ret));
+		stream->failed = 1;
+		return;
+	}
+	if (!stream->infinite)
+		stream->length -= len;
+	stream->active++;
+}
+
+static void LIBUSB_CALL
+chaoskey_stream_done(struct libusb_transfer *transfer)
+{
+	struct chaoskey_stream	*stream = transfer->user_data;
+	int			i;
+	int			ret;
+
+	stream->active--;
+	if (stream->failed)
+		return;
+
+	for (i = 0; i < transfer->actual_length; i += ret) {
+		ret = write(1, transfer->buffer + i, transfer->actual_length - i);
+		if (ret <= 0) {
+			perror("write");
+			stream->failed = 1;
+			return;
+		}
+	}
+
+	if (transfer->status != LIBUSB_TRANSFER_COMPLETED) {
+		fprintf(stderr, "read: %s\n", libusb_error_name(transfer->status));
+		stream->failed = 1;
+		return;
+	}
+
+	/* Ask again for whatever a short transfer did not deliver */
+	if (!stream->infinite)
+		stream->length += transfer->length - transfer->actual_length;
+	chaoskey_stream_submit(stream, transfer);
+}
+
+static int
+chaoskey_stream(struct chaoskey *ck, int endpoint, unsigned long length, int infinite)
+{
+	struct chaoskey_stream	*stream = &chaoskey_stream_state;
+	struct libusb_transfer	*transfers[CHAOS_TRANSFERS] = { 0 };
+	int			cancelled = 0;
+	int			ret;
+	int			t;
+
+	*stream = (struct chaoskey_stream) { .length = length, .infinite = infinite };
+
+	for (t = 0; t < CHAOS_TRANSFERS && !stream->failed; t++) {
+		transfers[t] = libusb_alloc_transfer(0);
+		if (!transfers[t]) {
+			fprintf(stderr, "libusb_alloc_transfer failed\n");
+			stream->failed = 1;
+			break;
+		}
+		libusb_fill_bulk_transfer(transfers[t], ck->handle, endpoint,
+					  chaoskey_stream_buf[t], CHAOS_TRANSFER_SIZE,
+					  chaoskey_stream_done, stream, USB_TIMEOUT_MS);
+		chaoskey_stream_submit(stream, transfers[t]);
+	}
+
+	while (stream->active) {
+		if (stream->failed && !cancelled) {
+			for (t = 0; t < CHAOS_TRANSFERS; t++)
+				if (transfers[t])
+					libusb_cancel_transfer(transfers[t]);
+			cancelled = 1;
+		}
+		ret = libusb_handle_events(ck->ctx);
+		if (ret && ret != LIBUSB_ERROR_INTERRUPTED) {
+			fprintf(stderr, "libusb_handle_events failed: %s\n", libusb_strerror(ret));
+			/* Cancel and reap the queued transfers; give up if even that fails */
+			if (cancelled)
+				break;
+			stream->failed = 1;
+		}
+	}
+
+	/* libusb must not free a transfer still in flight; exit reclaims those */
+	if (!stream->active)
+		for (t = 0; t < CHAOS_TRANSFERS; t++)
+			libusb_free_transfer(transfers[t]);
+	return stream->failed ? -1 : 0;
+}
+
 static const struct option options[] = {
 	{ .name = "serial", .has_arg = 1, .val = 's' },
 	{ .name = "length", .has_arg = 1, .val = 'l' },
@@ -239,6 +363,7 @@ main (int argc, char **argv)
 	struct chaoskey	*ck;
 	uint16_t	buf[CHAOS_BUF_SAMPLES];
 	int	got;
+	int	i;
 	int	c;
 	char	*serial = NULL;
 	char	*length_string;
@@ -302,8 +427,13 @@ main (int argc, char **argv)
 	if (!ck)
 		exit(1);
 
-	if (bytes)
-		length *= 2;
+	if (!bytes) {
+		if (chaoskey_stream(ck, endpoint, length, infinite) < 0)
+			finish(ck, 1);
+		finish(ck, 0);
+	}
+
+	length *= 2;
 
 	while (length || infinite) {
 		this_time = sizeof(buf);
@@ -314,21 +444,8 @@ main (int argc, char **argv)
 			perror("read");
 			finish(ck, 1);
 		}
-		if (bytes) {
-			int i;
-			for (i = 0; i < got / 2; i++)
-				putchar((buf[i] >> 1 & 0xff));
-		} else {
-			int i;
-			int ret;
-			for (i = 0; i < got; i += ret) {
-				ret = write(1, ((char *) buf) + i, got - i);
-				if (ret <= 0) {
-					perror("write");
-					finish(ck, 1);
-				}
-			}
-		}
+		for (i = 0; i < got / 2; i++)
+			putchar((buf[i] >> 1 & 0xff));
 		length -= got;
 	}
 	finish(ck, 0);
@@ -11,27 +11,53 @@ Note: Dieharder needs 14GiB of data to not re-use (rewind) input data.
 """
 
 import argparse
+import concurrent.futures
+import contextlib
+import errno
+import fcntl
+import itertools
+import mmap
+import os
+import queue
+import shutil
+import subprocess
 import sys
+import threading
 import time
+from collections.abc import Callable, Sequence
 from pathlib import Path
-from typing import BinaryIO
+from typing import IO, BinaryIO
 
 import usb.core
 
 from chaoskey_utils import (
     ENDPOINT_COOKED,
     ENDPOINT_RAW,
+    ByteStatistics,
     ChaosKeyDevice,
     check_test_binaries,
+    drop_file_cache,
+    feed_stream_tests,
     find_chaoskey_devices,
     run_dieharder,
     run_ent,
     run_rngtest,
+    start_dieharder,
+    start_ent,
+    start_rngtest,
 )
 
 # Data capture configuration
 DEFAULT_NUM_LOOPS: int = 14 * 1024  # 14 GiB for Dieharder to not repeat data
 DEFAULT_BLOCK_SIZE: int = 1024 * 1024  # 1 MiB per read
+DEFAULT_RING_DEPTH: int = 4  # Write slots in flight between USB reader and writer
+DEFAULT_WRITE_SIZE: int = 8 * 1024 * 1024  # Coalesce blocks into 8 MiB writes
+DIRECT_IO_ALIGNMENT: int = 4096  # O_DIRECT buffer/length alignment
+
+PROGRESS_INTERVAL_NS: int = 100_000_000  # Refresh progress at most at 10 Hz
+
+# Filled ring entry: (lane index, buffer or None at end, bytes read, error)
+_Block = tuple[int, memoryview | None, int, usb.core.USBError | None]
 
 # Endpoint name mapping
 ENDPOINT_MAP: dict[str, int] = {
@@ -51,6 +77,12 @@ Examples:
   %(prog)s --size 1            # Quick test with 1 GiB
   %(prog)s --endpoint raw      # Test raw ADC samples
   %(prog)s --serial ABC123     # Use specific device by serial
+  %(prog)s --all               # Split the capture across all devices
+  %(prog)s --stream            # Feed ent/rngtest/dieharder while capturing
+  %(prog)s --stream --no-save  # Test the live stream without a data file
+  %(prog)s --replay            # Capture first, then feed all tests in one pass
+  %(prog)s --no-ent            # Rely on the capture's byte statistics, skip ent
+  %(prog)s --native            # Capture with the chaosread C tool
 """,
     )
     parser.add_argument(
@@ -59,6 +91,19 @@ Examples:
         metavar="SERIAL",
         help="Device serial number to use",
     )
+    parser.add_argument(
+        "--devices",
+        "-d",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Capture from the first N devices in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Capture from all detected devices in parallel",
+    )
     parser.add_argument(
         "--endpoint",
         "-e",
@@ -81,7 +126,66 @@ Examples:
         metavar="FILE",
         help="Output filename (default: auto-generated)",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--io",
+        choices=["direct", "buffered", "mmap"],
+        help="Output file I/O: direct bypasses the page cache, mmap reads "
+        "straight into a mapping of the file (default: direct, or buffered "
+        "with --native)",
+    )
+    parser.add_argument(
+        "--write-coalesce",
+        type=int,
+        default=DEFAULT_WRITE_SIZE // (1024 * 1024),
+        metavar="MiB",
+        help="Gather this many MiB per output file write (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Pipe captured data into ent, rngtest and dieharder during "
+        "capture instead of re-reading the file afterwards (capture then "
+        "runs at the pace of the slowest test)",
+    )
+    parser.add_argument(
+        "--no-save",
+        action="store_true",
+        help="With --stream, do not write the captured data to a file",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="After capture, send the data file to ent, rngtest and dieharder "
+        "together in a single read pass instead of each reading it alone",
+    )
+    parser.add_argument(
+        "--no-ent",
+        action="store_true",
+        help="Skip ent; its byte statistics are computed during capture anyway",
+    )
+    parser.add_argument(
+        "--native",
+        action="store_true",
+        help="Capture with the chaosread C tool writing straight to the "
+        "output file, bypassing the Python capture loop",
+    )
+    args = parser.parse_args()
+    if args.devices < 1:
+        parser.error("--devices must be at least 1")
+    if args.serial and (args.all or args.devices > 1):
+        parser.error("--serial selects a single device")
+    if args.no_save and not args.stream:
+        parser.error("--no-save requires --stream")
+    if args.native and args.stream:
+        parser.error("--native cannot be combined with --stream")
+    if args.replay and args.stream:
+        parser.error("--replay cannot be combined with --stream")
+    if args.native and args.io is not None:
+        parser.error("--io cannot be combined with --native")
+    if args.io is None:
+        # chaosread writes from its own unaligned buffers
+        args.io = "buffered" if args.native else "direct"
+    return args
 
 
 def generate_filename(endpoint_name: str = "cooked") -> Path:
@@ -97,57 +201,431 @@ def generate_filename(endpoint_name: str = "cooked") -> Path:
     return Path(f"ChaosKey_{endpoint_name}_{datetime_string}.data")
 
 
-def capture_data(
-    device: ChaosKeyDevice,
+def open_output(filename: Path, direct: bool = True) -> BinaryIO:
+    """Open the capture file for writing.
+
+    With ``direct`` the file is opened with O_DIRECT so the capture does not
+    flood the page cache. Filesystems that reject O_DIRECT (tmpfs, some
+    overlays) fall back to regular buffered I/O.
+
+    Args:
+        filename: Path of the file to create or truncate.
+        direct: Whether to try bypassing the page cache.
+
+    Returns:
+        Binary file handle open for writing.
+    """
+    if direct and hasattr(os, "O_DIRECT"):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DIRECT
+        try:
+            fd = os.open(filename, flags, 0o666)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            print("O_DIRECT not supported here, using buffered I/O")
+        else:
+            return os.fdopen(fd, "wb", buffering=0)
+    return open(filename, "w+b")
+
+
+def preallocate(output_file: BinaryIO, size: int) -> bool:
+    """Reserve disk space for the whole capture up front.
+
+    Allocating all extents in one call avoids fragmentation and per-write
+    block allocation on large captures.
+
+    Args:
+        output_file: File handle from open_output().
+        size: Number of bytes to reserve.
+
+    Returns:
+        True if space was reserved, False if the filesystem does not support it.
+    """
+    if size <= 0:
+        return True  # Nothing to reserve; posix_fallocate rejects a zero length
+    try:
+        os.posix_fallocate(output_file.fileno(), 0, size)
+    except OSError as e:
+        print(f"Preallocation skipped: {e}")
+        return False
+    return True
+
+
+def trim_output(output_file: BinaryIO) -> None:
+    """Drop preallocated space the capture did not fill.
+
+    The file offset advances with every write that reaches the file, so it
+    is the running count of captured bytes even when the capture stopped
+    early on an error or an interrupt.
+
+    Args:
+        output_file: File handle from open_output().
+    """
+    with contextlib.suppress(OSError):
+        output_file.flush()
+    fd = output_file.fileno()
+    os.ftruncate(fd, os.lseek(fd, 0, os.SEEK_CUR))
+
+
+def map_output(output_file: BinaryIO, size: int) -> mmap.mmap:
+    """Size the capture file and map it into memory for writing.
+
+    Args:
+        output_file: Readable and writable file handle from open_output().
+        size: Number of bytes to map; must be positive.
+
+    Returns:
+        Shared writable mapping covering the first ``size`` bytes.
+    """
+    if not preallocate(output_file, size):
+        os.ftruncate(output_file.fileno(), size)
+    mapping = mmap.mmap(output_file.fileno(), size)
+    mapping.madvise(mmap.MADV_SEQUENTIAL)
+    return mapping
+
+
+def unmap_output(output_file: BinaryIO, mapping: mmap.mmap) -> None:
+    """Write back and unmap a capture mapping, then trim the file to its data.
+
+    capture_data() advances the mapping's position past every filled
+    block, so the file keeps only the captured bytes even when the capture
+    stopped early on an error or an interrupt.
+
+    Args:
+        output_file: File handle the mapping was created from.
+        mapping: Mapping returned by map_output().
+    """
+    size = mapping.tell()
+    mapping.flush()
+    # Views into the mapping may outlive a failed capture in its traceback
+    with contextlib.suppress(BufferError):
+        mapping.close()
+    os.ftruncate(output_file.fileno(), size)
+
+
+def _write_block(output_file: IO[bytes], data: memoryview) -> None:
+    """Write a whole block, coping with O_DIRECT length constraints.
+
+    Args:
+        output_file: File handle from open_output(), or a test tool pipe.
+        data: Bytes to write.
+    """
+    if len(data) % DIRECT_IO_ALIGNMENT:
+        # O_DIRECT rejects unaligned lengths; send a short tail through the
+        # page cache instead.
+        fd = output_file.fileno()
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        if flags & getattr(os, "O_DIRECT", 0):
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+
+    while data:
+        written = output_file.write(data)
+        data = data[written:]
+
+
+def capture_native(
     output_file: BinaryIO,
-    endpoint: int = ENDPOINT_COOKED,
+    serial: str | None = None,
+    endpoint_name: str = "cooked",
     num_loops: int = DEFAULT_NUM_LOOPS,
     block_size: int = DEFAULT_BLOCK_SIZE,
 ) -> int:
-    """Capture random data from ChaosKey device with progress display.
+    """Capture random data with the chaosread C tool.
+
+    chaosread drives libusb itself and writes to the output file descriptor
+    directly, so the whole capture is a single native call with no
+    per-block interpreter work. It keeps several large bulk transfers
+    queued, so the device keeps sending while completed ones are written.
+    The device must not be open in Python.
 
     Args:
-        device: Open ChaosKeyDevice instance.
         output_file: Open file handle to write data to.
-        endpoint: USB endpoint to read from.
-        num_loops: Number of blocks to read.
+        serial: Optional serial number of the device to use.
+        endpoint_name: Endpoint name ("cooked" or "raw").
+        num_loops: Number of blocks to capture.
         block_size: Size of each block in bytes.
 
     Returns:
         Total bytes captured.
+
+    Raises:
+        RuntimeError: If the chaosread binary cannot be found or fails.
     """
-    total_bytes = 0
+    chaosread = shutil.which("chaosread")
+    if chaosread is None:
+        raise RuntimeError(
+            "chaosread not found; build it with ./autogen.sh && make && make install"
+        )
 
-    for i in range(num_loops):
-        try:
-            before = time.time()
-            data = device.read(endpoint, block_size)
-            after = time.time()
-        except usb.core.USBError as e:
-            print(f"\nRead failed at block {i + 1}: {e}")
-            break
-
-        if len(data) == 0:
-            print(f"\nNo data received at block {i + 1}")
-            break
-
-        total_bytes += len(data)
-        output_file.write(data)
-
-        # Calculate transfer rate
-        elapsed = after - before
-        if elapsed > 0:
-            rate = float(len(data)) / (elapsed * 1_000_000.0) * 8
-        else:
-            rate = 0.0
+    args = [chaosread, f"--{endpoint_name}", f"--length={num_loops * block_size}"]
+    if serial:
+        args.append(f"--serial={serial}")
+
+    output_file.flush()
+    result = subprocess.run(args, stdout=output_file, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"chaosread exited with status {result.returncode}")
+
+    # chaosread shares our file offset, which now marks the end of its data
+    return os.lseek(output_file.fileno(), 0, os.SEEK_CUR)
+
+
+class _Lane:
+    """Capture state for one device: its reader thread, ring and progress."""
+
+    def __init__(self, index: int, device: ChaosKeyDevice, num_loops: int) -> None:
+        """Initialize an idle lane.
+
+        Args:
+            index: Position of the lane, tagged onto every block it reads.
+            device: Open ChaosKeyDevice instance.
+            num_loops: Number of blocks this lane reads.
+        """
+        self.index = index
+        self.device = device
+        self.num_loops = num_loops
+        self.free: queue.Queue[memoryview | None] = queue.Queue()
+        self.slots: list[memoryview] = []
+        self.slot: memoryview | None = None  # Slot holding the pending range
+        self.blocks = 0  # Blocks received so far
+        self.pending_start = 0  # Unwritten range of the current slot
+        self.pending_end = 0
+
+
+def _read_blocks(
+    lane: _Lane,
+    endpoint: int,
+    filled: queue.Queue[_Block],
+) -> None:
+    """Fill a lane's ring buffers from its device and hand them to the writer.
+
+    Runs in its own thread so USB reception continues while earlier blocks
+    are being written out. Puts ``(index, None, 0, None)`` on ``filled``
+    when done.
+
+    Args:
+        lane: Lane whose device and free buffer queue to use; a ``None``
+            buffer asks the reader to stop.
+        endpoint: USB endpoint to read from.
+        filled: Queue receiving ``(index, buffer, count, error)`` tuples.
+    """
+    try:
+        for _ in range(lane.num_loops):
+            buffer = lane.free.get()
+            if buffer is None:
+                break
+            try:
+                count = lane.device.read_into(endpoint, buffer)
+            except usb.core.USBError as e:
+                filled.put((lane.index, buffer, 0, e))
+                break
+            filled.put((lane.index, buffer, count, None))
+            if count == 0:
+                break
+    finally:
+        filled.put((lane.index, None, 0, None))
+
+
+def _flush_lane(lane: _Lane, emit: Callable[[memoryview], None]) -> None:
+    """Hand the pending range of a lane's current slot to the outputs.
 
-        # Display progress
-        progress = (i + 1) * 100 / num_loops
-        sys.stdout.write(
-            f"\r{i + 1} of {num_loops} MiB ({progress:2.1f}%) "
-            f"Read at {rate:2.3f} Mbits/s"
+    Args:
+        lane: Lane to flush.
+        emit: Callback receiving the pending bytes.
+    """
+    if lane.slot is not None and lane.pending_end > lane.pending_start:
+        emit(lane.slot[lane.pending_start : lane.pending_end])
+    lane.pending_start = lane.pending_end
+
+
+def capture_data(
+    devices: ChaosKeyDevice | Sequence[ChaosKeyDevice],
+    output_file: BinaryIO | mmap.mmap | None,
+    endpoint: int = ENDPOINT_COOKED,
+    num_loops: int = DEFAULT_NUM_LOOPS,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    ring_depth: int = DEFAULT_RING_DEPTH,
+    pipes: Sequence[IO[bytes]] = (),
+    write_size: int = DEFAULT_WRITE_SIZE,
+    stats: ByteStatistics | None = None,
+) -> int:
+    """Capture random data from ChaosKey devices with progress display.
+
+    A background thread per device reads into its own ring of preallocated
+    buffers while this thread writes completed buffers to ``output_file``,
+    so USB transfers and disk writes overlap. Each ring slot holds several
+    consecutive blocks and is written with a single call once full. The
+    slots are page-aligned anonymous mappings, as O_DIRECT output requires.
+    With several devices the blocks are split between them and their slots
+    are appended to the output in the order they complete. Test pipes and
+    statistics see the data in the same order as the file.
+
+    When ``output_file`` is a file mapping, blocks are read straight into
+    consecutive slices of it and no write calls are needed. A mapping
+    cannot have gaps, so it takes a single device and the capture stops at
+    the first short read.
+
+    Args:
+        devices: Open ChaosKeyDevice instance, or several to read in parallel.
+        output_file: Open file handle to write data to, a writable mapping
+            of at least ``num_loops * block_size`` bytes, or None to only
+            feed ``pipes``.
+        endpoint: USB endpoint to read from.
+        num_loops: Number of blocks to read in total.
+        block_size: Size of each block in bytes.
+        ring_depth: Number of ring slots per device that may be in flight.
+        pipes: Test tool stdin pipes that also receive every block. A pipe
+            whose reader has exited is dropped.
+        write_size: Bytes gathered per file write, rounded down to a whole
+            number of blocks. With a mapping, the finished part is written
+            back and unmapped in steps of this size.
+        stats: Running byte statistics to update with every block.
+
+    Returns:
+        Total bytes captured.
+
+    Raises:
+        ValueError: If a file mapping is combined with several devices.
+    """
+    if isinstance(devices, ChaosKeyDevice):
+        devices = [devices]
+    lanes = [
+        _Lane(index, device, len(range(index, num_loops, len(devices))))
+        for index, device in enumerate(devices)
+    ]
+    filled: queue.Queue[_Block] = queue.Queue()
+    blocks_per_write = max(1, write_size // block_size)
+    slot_size = blocks_per_write * block_size
+    if isinstance(output_file, mmap.mmap):
+        if len(lanes) != 1:
+            raise ValueError("A file mapping can only be filled by one device")
+        # Each slice of the file mapping is filled once, in order
+        mapped = memoryview(output_file)
+        slices = (
+            mapped[i * block_size : (i + 1) * block_size] for i in range(num_loops)
+        )
+        for first in itertools.islice(slices, ring_depth):
+            lanes[0].free.put(first)
+    else:
+        for lane in lanes:
+            lane.slots = [
+                memoryview(mmap.mmap(-1, slot_size)) for _ in range(ring_depth)
+            ]
+            for slot in lane.slots:
+                for start in range(0, slot_size, block_size):
+                    lane.free.put(slot[start : start + block_size])
+
+    readers = [
+        threading.Thread(
+            target=_read_blocks, args=(lane, endpoint, filled), daemon=True
         )
-        sys.stdout.flush()
+        for lane in lanes
+    ]
+    for reader in readers:
+        reader.start()
+
+    live_pipes = list(pipes)
+    total_bytes = 0
+    done = 0  # Blocks received from all lanes
+    active = len(lanes)
+    # Progress is considered every progress_stride blocks (at most 1000
+    # times per capture) and printed at most every PROGRESS_INTERVAL_NS.
+    progress_stride = max(1, num_loops // 1000)
+    progress_format = f"\r%d of {num_loops} MiB (%2.1f%%) Read at %2.3f Mbits/s"
+    percent_per_block = 100 / num_loops if num_loops else 0.0
+    start_ns = last_print_ns = time.monotonic_ns()
+
+    def emit(data: memoryview) -> None:
+        """Pass captured bytes on to the output file, test pipes and stats."""
+        if output_file is not None and not isinstance(output_file, mmap.mmap):
+            _write_block(output_file, data)
+        for pipe in list(live_pipes):
+            try:
+                _write_block(pipe, data)
+            except BrokenPipeError:
+                print(f"\nTest stopped reading at block {done}")
+                live_pipes.remove(pipe)
+        if stats is not None:
+            for offset in range(0, len(data), block_size):
+                stats.update(data[offset : offset + block_size])
+
+    try:
+        while active:
+            index, buffer, count, error = filled.get()
+            lane = lanes[index]
+
+            if buffer is None:
+                # Reader finished; write what an early stop left behind
+                if not isinstance(output_file, mmap.mmap):
+                    _flush_lane(lane, emit)
+                active -= 1
+                continue
+
+            if error is not None:
+                print(f"\nRead failed at block {done + 1}: {error}")
+                continue
+
+            if count == 0:
+                print(f"\nNo data received at block {done + 1}")
+                continue
+
+            block = lane.blocks
+            lane.blocks += 1
+            done += 1
+            total_bytes += count
+
+            if not isinstance(output_file, mmap.mmap):
+                # Blocks fill the lane's slots in order; write a slot once it
+                # is full, or early after a short read leaves a gap in it.
+                lane.slot = lane.slots[block // blocks_per_write % len(lane.slots)]
+                start = block % blocks_per_write * block_size
+                slot_done = start + block_size == slot_size
+                if start == 0:
+                    lane.pending_start = 0
+                lane.pending_end = start + count
+                if count < block_size or slot_done or lane.blocks == lane.num_loops:
+                    _flush_lane(lane, emit)
+                    lane.pending_start = lane.pending_end = start + block_size
+                if slot_done:
+                    for offset in range(0, slot_size, block_size):
+                        lane.free.put(lane.slot[offset : offset + block_size])
+            else:
+                emit(buffer[:count])
+                # The mapping's position is the running count of filled bytes
+                output_file.seek(count, os.SEEK_CUR)
+                if count < block_size:
+                    print(f"\nShort read at block {done}, stopping capture")
+                    break
+                next_slice = next(slices, None)
+                if next_slice is not None:
+                    lane.free.put(next_slice)
+                # Written-back, unmapped pages are cheap for the kernel to
+                # reclaim, so the capture does not pin the page cache.
+                if done % blocks_per_write == 0:
+                    region = done * block_size - slot_size
+                    output_file.flush(region, slot_size)
+                    output_file.madvise(mmap.MADV_DONTNEED, region, slot_size)
+
+            # Display progress, throttled; the rate is the average so far
+            if done % progress_stride and done < num_loops:
+                continue
+            now_ns = time.monotonic_ns()
+            if now_ns - last_print_ns < PROGRESS_INTERVAL_NS and done < num_loops:
+                continue
+            last_print_ns = now_ns
+            rate = total_bytes * 8000 / max(now_ns - start_ns, 1)
+            sys.stdout.write(progress_format % (done, done * percent_per_block, rate))
+            sys.stdout.flush()
+    finally:
+        for lane in lanes:
+            # Drop the buffers still queued so a reader stops after its
+            # current block instead of filling the whole ring first
+            with contextlib.suppress(queue.Empty):
+                while True:
+                    lane.free.get_nowait()
+            lane.free.put(None)  # Wake readers waiting for a buffer
+        for reader in readers:
+            reader.join()
 
     print()  # Newline after progress
     return total_bytes
@@ -169,8 +647,17 @@ def main() -> int:
     print("ChaosKey Full Testing")
     print("=" * 50)
 
+    # ent's byte statistics are also computed during capture, so it may be skipped
+    required = ["dieharder", "rngtest"]
+    starters = [start_rngtest, start_dieharder]
+    runners = [run_rngtest, run_dieharder]
+    if not args.no_ent:
+        required.insert(0, "ent")
+        starters.insert(0, start_ent)
+        runners.insert(0, run_ent)
+
     # Check for required test binaries first
-    missing = check_test_binaries()
+    missing = check_test_binaries(required)
     if missing:
         print(f"Missing test binaries: {', '.join(missing)}")
         print("Install with: sudo pacman -S ent rng-tools dieharder")
@@ -194,10 +681,26 @@ def main() -> int:
     for dev in devices:
         print(f"  Bus {dev['bus']:03d} Device {dev['address']:03d}: {dev['serial']}")
 
-    # Determine which device to use
-    serial_to_use = args.serial
-    if serial_to_use:
-        print(f"\nUsing device with serial: {serial_to_use}")
+    # Determine which devices to use
+    num_devices = len(devices) if args.all else args.devices
+    serials_to_use: list[str | None] = [args.serial]
+    if args.serial:
+        print(f"\nUsing device with serial: {args.serial}")
+    elif num_devices > 1:
+        if num_devices > len(devices):
+            print(f"\nOnly {len(devices)} device(s) detected")
+            return 1
+        if args.native or args.io == "mmap":
+            print("\nSeveral devices cannot be used with --native or --io mmap")
+            return 1
+        serials_to_use = []
+        for dev in devices[:num_devices]:
+            serial = dev["serial"]
+            if not isinstance(serial, str):
+                print("\nCannot tell devices apart: a serial number is unreadable")
+                return 1
+            serials_to_use.append(serial)
+        print(f"\nUsing {num_devices} devices: {', '.join(map(str, serials_to_use))}")
     else:
         print(f"\nUsing first detected device: {devices[0]['serial']}")
 
@@ -215,20 +718,69 @@ def main() -> int:
     print(f"Number of loops: {num_loops}")
     print(f"Total size:      {args.size:.2f} GiB")
     print(f"Endpoint:        {args.endpoint} (0x{endpoint:02X})")
-    print(f"Writing to:      {output_filename}")
+    print(f"Writing to:      {'(not saved)' if args.no_save else output_filename}")
+    print(f"Output I/O:      {args.io}")
+    print(f"Streaming tests: {'yes' if args.stream else 'no'}")
     print("=" * 50)
 
+    # Start stream consumers before the device is busy
+    testers: list[subprocess.Popen[bytes]] = []
+    if args.stream:
+        for start in starters:
+            proc = start(output_filename)
+            if proc is not None:
+                testers.append(proc)
+
     # Capture data
     try:
-        with ChaosKeyDevice(serial=serial_to_use) as device:
-            print(f"Device opened: {device.serial}")
+        with contextlib.ExitStack() as stack:
+            opened: list[ChaosKeyDevice] = []
+            if not args.native:
+                for serial in serials_to_use:
+                    device = stack.enter_context(ChaosKeyDevice(serial=serial))
+                    print(f"Device opened: {device.serial}")
+                    opened.append(device)
             print("Starting data capture...")
 
-            with open(output_filename, "wb") as fp:
+            fp = None
+            if not args.no_save:
+                fp = stack.enter_context(
+                    open_output(output_filename, direct=args.io == "direct")
+                )
+            total_size = num_loops * DEFAULT_BLOCK_SIZE
+            output: BinaryIO | mmap.mmap | None = fp
+            # Trimming is registered before the capture so it also runs on
+            # failure. An empty file cannot be mapped, so --size 0 writes it.
+            if fp is not None and args.io == "mmap" and total_size:
+                output = map_output(fp, total_size)
+                stack.callback(unmap_output, fp, output)
+            elif fp is not None:
+                preallocate(fp, total_size)
+                stack.callback(trim_output, fp)
+
+            stats = ByteStatistics()
+            if not opened:
+                # --no-save needs --stream, which --native rejects
+                assert fp is not None
+                total_bytes = capture_native(
+                    fp, serials_to_use[0], args.endpoint, num_loops=num_loops
+                )
+            else:
                 total_bytes = capture_data(
-                    device, fp, endpoint=endpoint, num_loops=num_loops
+                    opened,
+                    output,
+                    endpoint=endpoint,
+                    num_loops=num_loops,
+                    pipes=[proc.stdin for proc in testers if proc.stdin],
+                    write_size=args.write_coalesce * 1024 * 1024,
+                    stats=stats,
                 )
-                print(f"Captured {total_bytes / 1024 / 1024:.2f} MiB")
+            print(f"Captured {total_bytes / 1024 / 1024:.2f} MiB")
+            if stats.count:
+                print(f"Entropy:            {stats.entropy:.6f} bits per byte")
+                print(f"Chi-square:         {stats.chi_square:.2f}")
+                print(f"Arithmetic mean:    {stats.mean:.4f} (127.5 = random)")
+                print(f"Serial correlation: {stats.serial_correlation:.6f}")
 
     except usb.core.USBError as e:
         if e.errno == 13:  # Permission denied
@@ -246,17 +798,45 @@ def main() -> int:
     except OSError as e:
         print(f"\nError opening output file: {e}")
         return 1
+    finally:
+        # End of input lets the stream consumers finish (or give up)
+        for proc in testers:
+            if proc.stdin:
+                proc.stdin.close()
 
     # Run statistical tests
     print("\nRunning statistical tests...")
-    run_ent(output_filename)
-    run_rngtest(output_filename)
-    run_dieharder(output_filename)
+    if args.stream:
+        print("\nWaiting for the tests to finish...")
+        for proc in testers:
+            proc.wait()
+    elif args.replay:
+        testers = []
+        for start in starters:
+            proc = start(output_filename)
+            if proc is not None:
+                testers.append(proc)
+        feed_stream_tests(output_filename, testers)
+        print("\nWaiting for the tests to finish...")
+        for proc in testers:
+            proc.wait()
+    else:
+        # Independent tools, so total time is that of the slowest one
+        with concurrent.futures.ThreadPoolExecutor(len(runners)) as executor:
+            futures = [
+                executor.submit(run_test, output_filename) for run_test in runners
+            ]
+            for future in futures:
+                future.result()
+
+    if not args.no_save:
+        drop_file_cache(output_filename)
 
     print("\n" + "=" * 50)
     print("Testing complete!")
-    print(f"Data file:     {output_filename}")
-    print(f"ent results:   {output_filename}.ent.txt")
+    print(f"Data file:     {'(not saved)' if args.no_save else output_filename}")
+    if not args.no_ent:
+        print(f"ent results:   {output_filename}.ent.txt")
     print(f"rngtest:       {output_filename}.rngtest.txt")
     print(f"dieharder:     {output_filename}.dieharder.txt")
 